@@ -289,6 +289,9 @@ class Data(Base):
                 data_nu, (sparse.csr_matrix, sparse.csc_matrix, sparse.bsr_matrix)
             ):
                 data_nu = data_nu.tocsr()
+            elif isinstance(data_nu, np.ndarray):
+                # neighbor searches and cdist copy non-contiguous input
+                data_nu = np.ascontiguousarray(data_nu)
             return data_nu
 
     def get_params(self):
@@ -557,15 +560,19 @@ class BaseGraph(with_metaclass(abc.ABCMeta, Base)):
         # symmetrize
         if self.kernel_symm == "+":
             _logger.debug("Using addition symmetrization.")
-            K = (K + K.T) / 2
+            K = (K + K.T) * 0.5
         elif self.kernel_symm == "*":
             _logger.debug("Using multiplication symmetrization.")
             K = K.multiply(K.T)
         elif self.kernel_symm == "mnn":
             _logger.debug("Using mnn symmetrization (theta = {}).".format(self.theta))
-            K = self.theta * matrix.elementwise_minimum(K, K.T) + (
-                1 - self.theta
-            ) * matrix.elementwise_maximum(K, K.T)
+            KT = K.T
+            if self.theta == 1:
+                K = matrix.elementwise_minimum(K, KT)
+            elif self.theta == 0:
+                K = matrix.elementwise_maximum(K, KT)
+            else:
+                K = matrix.symmetric_minmax(K, self.theta)
         elif self.kernel_symm is None:
             _logger.debug("Using no symmetrization.")
             pass
@@ -624,6 +631,18 @@ class BaseGraph(with_metaclass(abc.ABCMeta, Base)):
         super().set_params(**params)
         return self
 
+    def _reset_kernel(self):
+        """Reset the kernel and everything derived from it
+
+        The kernel is recomputed the next time it is accessed
+        """
+        for attr in ["_kernel", "_diff_op", "_kernel_degree"]:
+            try:
+                delattr(self, attr)
+            except AttributeError:
+                # not currently defined
+                pass
+
     @property
     def P(self):
         """Diffusion operator (cached)
@@ -246,7 +246,11 @@ class GraphEstimator(object, metaclass=abc.ABCMeta):
                     params["n_landmark"] = self._parse_n_landmark(
                         self.graph.data_nu, params["n_landmark"]
                     )
+                had_kernel = hasattr(self.graph, "_kernel")
                 self.graph.set_params(**params)
+                if had_kernel and not hasattr(self.graph, "_kernel"):
+                    # the graph rebuilds its kernel in place
+                    self._reset_graph()
             except ValueError as e:
                 _logger.debug("Reset graph due to {}".format(str(e)))
                 self.graph = None
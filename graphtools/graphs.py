@@ -3,11 +3,12 @@ from builtins import super
 import numpy as np
 from sklearn.neighbors import NearestNeighbors
 from sklearn.utils.extmath import randomized_svd
-from sklearn.preprocessing import normalize
 from sklearn.cluster import MiniBatchKMeans
-from scipy.spatial.distance import pdist, cdist
-from scipy.spatial.distance import squareform
+from scipy.spatial.distance import cdist
+from scipy.spatial import cKDTree
 from scipy import sparse
+from joblib import Parallel, delayed, effective_n_jobs
+import itertools
 import numbers
 import warnings
 import tasklogger
@@ -17,6 +18,247 @@ from .base import DataGraph, PyGSPGraph
 
 _logger = tasklogger.get_tasklogger("graphtools")
 
+# number of rows of a distance matrix or neighbor search held in memory at once
+_BLOCK_SIZE = 1024
+# number of affinities computed per step of the alpha decay kernel
+_CHUNK_SIZE = 2 ** 16
+
+# metrics served by `scipy.spatial.cKDTree`, mapped to the Minkowski p-norm
+_KDTREE_METRICS = {
+    "euclidean": 2,
+    "l2": 2,
+    "minkowski": 2,
+    "cityblock": 1,
+    "manhattan": 1,
+    "l1": 1,
+    "chebyshev": np.inf,
+}
+
+
+def _alpha_decay(data, decay, thresh):
+    """Alpha decay kernel, computed in place
+
+    Replaces the bandwidth-scaled distances in `data` (a contiguous array)
+    with affinities `exp(-data ** decay)`, setting NaN to one and zeroing
+    affinities below `thresh`. Works through `data` in cache-sized chunks so
+    that each element is only read from main memory once.
+    """
+    flat = data.reshape(-1)
+    for start in range(0, flat.shape[0], _CHUNK_SIZE):
+        chunk = flat[start : start + _CHUNK_SIZE]
+        np.power(chunk, decay, out=chunk)
+        np.negative(chunk, out=chunk)
+        np.exp(chunk, out=chunk)
+        # handle nan
+        chunk[np.isnan(chunk)] = 1
+        chunk[chunk < thresh] = 0
+    return data
+
+
+def _affinity_dtype(data):
+    """Floating point dtype of the affinities computed from `data`
+
+    Single precision data gives single precision affinities, halving the
+    memory of the kernel; anything else is computed in double precision.
+    """
+    return np.float32 if data.dtype == np.float32 else np.float64
+
+
+def _square_cdist(X, metric="euclidean"):
+    """Square matrix of pairwise distances
+
+    Computes the upper triangle block by block with `cdist` and mirrors it,
+    writing straight into the square output.
+    """
+    n_samples = X.shape[0]
+    pdx = np.empty((n_samples, n_samples))
+    for start in range(0, n_samples, _BLOCK_SIZE):
+        stop = min(start + _BLOCK_SIZE, n_samples)
+        block = cdist(X[start:stop], X[start:], metric=metric)
+        pdx[start:stop, start:] = block
+        pdx[start:, start:stop] = block.T
+    np.fill_diagonal(pdx, 0)
+    return pdx
+
+
+def _symmetrize_average(K):
+    """Average a square dense matrix with its transpose, in place
+
+    Works through the upper triangle block by block, writing each averaged
+    block and its mirror so that no second square matrix is allocated.
+    """
+    n_samples = K.shape[0]
+    for start in range(0, n_samples, _BLOCK_SIZE):
+        stop = min(start + _BLOCK_SIZE, n_samples)
+        block = K[start:stop, start:]
+        block += K[start:, start:stop].T
+        block *= 0.5
+        K[start:, start:stop] = block.T
+    return K
+
+
+class _KDTreeNeighbors(object):
+    """KNN search with `scipy.spatial.cKDTree`
+
+    Exposes the query interface of `sklearn.neighbors.NearestNeighbors` used
+    on `kNNGraph.knn_tree`. Queries are parallelized over `n_jobs` threads.
+
+    Parameters
+    ----------
+
+    n_neighbors : `int`, optional (default: 5)
+        Number of neighbors to use by default for `kneighbors` queries
+
+    radius : `float`, optional (default: 1.0)
+        Range of parameter space to use by default for `radius_neighbors`
+        queries
+
+    p : `float`, optional (default: 2)
+        Which Minkowski p-norm to use
+
+    n_jobs : `int`, optional (default: 1)
+        Number of threads used for queries. Follows the `joblib` convention.
+
+    leafsize : `int`, optional (default: 16)
+        Number of points at which the tree switches to brute force
+    """
+
+    def __init__(self, n_neighbors=5, radius=1.0, p=2, n_jobs=1, leafsize=16):
+        self.n_neighbors = n_neighbors
+        self.radius = radius
+        self.p = p
+        self.n_jobs = n_jobs
+        self.leafsize = leafsize
+
+    def fit(self, X):
+        self._tree = cKDTree(
+            matrix.to_array(X),
+            leafsize=self.leafsize,
+            compact_nodes=True,
+            balanced_tree=True,
+        )
+        return self
+
+    def set_params(self, **params):
+        for key, value in params.items():
+            setattr(self, key, value)
+        return self
+
+    @property
+    def _workers(self):
+        return effective_n_jobs(self.n_jobs)
+
+    def kneighbors(self, X=None, n_neighbors=None, return_distance=True):
+        """Nearest neighbors, nearest first
+
+        If `X` is `None`, queries the fitted data without matching each point
+        to itself, as in `sklearn`.
+        """
+        if n_neighbors is None:
+            n_neighbors = self.n_neighbors
+        query_is_train = X is None
+        if query_is_train:
+            X = self._tree.data
+            n_neighbors += 1
+        else:
+            X = matrix.to_array(X)
+        distances, indices = self._tree.query(
+            X, k=n_neighbors, p=self.p, workers=self._workers
+        )
+        distances = distances.reshape(X.shape[0], -1)
+        indices = indices.reshape(X.shape[0], -1)
+        if query_is_train:
+            sample_mask = indices != np.arange(X.shape[0])[:, None]
+            # with duplicates a point may not be its own first neighbor:
+            # drop the first neighbor instead
+            sample_mask[np.all(sample_mask, axis=1), 0] = False
+            distances = distances[sample_mask].reshape(X.shape[0], -1)
+            indices = indices[sample_mask].reshape(X.shape[0], -1)
+        if return_distance:
+            return distances, indices
+        return indices
+
+    def kneighbors_graph(self, X=None, n_neighbors=None, mode="connectivity"):
+        distances, indices = self.kneighbors(X, n_neighbors=n_neighbors)
+        if mode == "connectivity":
+            data = np.ones(indices.size)
+        else:
+            data = distances.reshape(-1)
+        return sparse.csr_matrix(
+            (
+                data,
+                indices.reshape(-1),
+                np.arange(0, indices.size + 1, indices.shape[1]),
+            ),
+            shape=(indices.shape[0], self._tree.n),
+        )
+
+    def radius_neighbors(self, X=None, radius=None, return_distance=True):
+        """Neighbors within `radius`, nearest first
+
+        If `X` is `None`, queries the fitted data without matching each point
+        to itself, as in `sklearn`. Unlike `sklearn`, `radius` may also be an
+        array giving the radius of each row of `X`.
+        """
+        if radius is None:
+            radius = self.radius
+        query_is_train = X is None
+        if query_is_train:
+            X = self._tree.data
+        else:
+            X = matrix.to_array(X)
+        indices = self._tree.query_ball_point(
+            X, r=radius, p=self.p, workers=self._workers
+        )
+        row_lengths = np.fromiter(
+            (len(i) for i in indices), dtype=np.intp, count=len(indices)
+        )
+        rows = np.repeat(np.arange(X.shape[0]), row_lengths)
+        cols = np.fromiter(
+            itertools.chain.from_iterable(indices),
+            dtype=np.intp,
+            count=np.sum(row_lengths),
+        )
+        if query_is_train:
+            not_self = rows != cols
+            rows, cols = rows[not_self], cols[not_self]
+            row_lengths = np.bincount(rows, minlength=X.shape[0])
+        distances = np.empty(len(cols))
+        for start in range(0, len(cols), _CHUNK_SIZE):
+            stop = start + _CHUNK_SIZE
+            distances[start:stop] = np.linalg.norm(
+                X[rows[start:stop]] - self._tree.data[cols[start:stop]],
+                ord=self.p,
+                axis=1,
+            )
+        # nearest neighbors first
+        order = np.lexsort((distances, rows))
+        splits = np.cumsum(row_lengths)[:-1]
+        # ragged rows are returned as object arrays, as in sklearn
+        neigh_ind = np.empty(X.shape[0], dtype=object)
+        neigh_ind[:] = np.split(cols[order], splits)
+        if not return_distance:
+            return neigh_ind
+        neigh_dist = np.empty(X.shape[0], dtype=object)
+        neigh_dist[:] = np.split(distances[order], splits)
+        return neigh_dist, neigh_ind
+
+    def radius_neighbors_graph(self, X=None, radius=None, mode="connectivity"):
+        distances, indices = self.radius_neighbors(X, radius=radius)
+        row_lengths = np.fromiter(
+            (len(i) for i in indices), dtype=np.intp, count=len(indices)
+        )
+        indptr = np.zeros(len(row_lengths) + 1, dtype=np.intp)
+        np.cumsum(row_lengths, out=indptr[1:])
+        if mode == "connectivity":
+            data = np.ones(indptr[-1])
+        else:
+            data = np.concatenate(distances)
+        return sparse.csr_matrix(
+            (data, np.concatenate(indices), indptr),
+            shape=(len(row_lengths), self._tree.n),
+        )
+
 
 class kNNGraph(DataGraph):
     """
@@ -68,8 +310,10 @@ class kNNGraph(DataGraph):
     Attributes
     ----------
 
-    knn_tree : `sklearn.neighbors.NearestNeighbors`
-        The fitted KNN tree. (cached)
+    knn_tree : `sklearn.neighbors.NearestNeighbors`-like
+        The fitted KNN tree. (cached) Dense data with a Minkowski-family
+        `distance` is served by `scipy.spatial.cKDTree` behind the same
+        query interface.
         TODO: can we be more clever than sklearn when it comes to choosing
         between KD tree, ball tree and brute force?
     """
@@ -174,14 +418,17 @@ class kNNGraph(DataGraph):
         - n_jobs
         - random_state
         - verbose
+        - knn (rebuilds the kernel, reusing the KNN tree)
+        - thresh (rebuilds the kernel, reusing the KNN tree)
         Invalid parameters: (these would require modifying the kernel matrix)
-        - knn
         - knn_max
         - decay
         - bandwidth
         - bandwidth_scale
         - distance
-        - thresh
+
+        `knn` and `thresh` cannot be updated on PyGSP graphs or
+        when using PyNNDescent.
 
         Parameters
         ----------
@@ -191,9 +438,19 @@ class kNNGraph(DataGraph):
         -------
         self
         """
+        # the kernel can only be rebuilt if nothing else was built from it
+        # and the KNN tree does not depend on knn
+        can_reset_kernel = not (isinstance(self, PyGSPGraph) or self.use_pynndescent)
+        knn, thresh = self.knn, self.thresh
         if "knn" in params and params["knn"] != self.knn:
-            raise ValueError("Cannot update knn. Please create a new graph")
-        if "knn_max" in params and params["knn_max"] != self.knn:
+            if (
+                not can_reset_kernel
+                or params["knn"] > self.data_nu.shape[0] - 2
+                or (self.knn_max is not None and params["knn"] > self.knn_max)
+            ):
+                raise ValueError("Cannot update knn. Please create a new graph")
+            knn = params["knn"]
+        if "knn_max" in params and params["knn_max"] != self.knn_max:
             raise ValueError("Cannot update knn_max. Please create a new graph")
         if "decay" in params and params["decay"] != self.decay:
             raise ValueError("Cannot update decay. Please create a new graph")
@@ -206,8 +463,12 @@ class kNNGraph(DataGraph):
             raise ValueError("Cannot update bandwidth_scale. Please create a new graph")
         if "distance" in params and params["distance"] != self.distance:
             raise ValueError("Cannot update distance. " "Please create a new graph")
-        if "thresh" in params and params["thresh"] != self.thresh and self.decay != 0:
-            raise ValueError("Cannot update thresh. Please create a new graph")
+        if "thresh" in params and params["thresh"] != self.thresh:
+            thresh = params["thresh"]
+            if self.decay is not None:
+                if not can_reset_kernel or (thresh <= 0 and self.knn_max is None):
+                    raise ValueError("Cannot update thresh. Please create a new graph")
+                thresh = max(thresh, np.finfo(float).eps)
         if "n_jobs" in params:
             self.n_jobs = params["n_jobs"]
             if hasattr(self, "_knn_tree"):
@@ -218,6 +479,13 @@ class kNNGraph(DataGraph):
             self.verbose = params["verbose"]
         # update superclass parameters
         super().set_params(**params)
+        # only change the kernel once every parameter has been accepted
+        reset_kernel = knn != self.knn or (
+            self.decay is not None and thresh != self.thresh
+        )
+        self.knn, self.thresh = knn, thresh
+        if reset_kernel:
+            self._reset_kernel()
         return self
 
     @property
@@ -230,7 +498,9 @@ class kNNGraph(DataGraph):
 
         Returns
         -------
-        knn_tree : `sklearn.neighbors.NearestNeighbors`
+        knn_tree : `sklearn.neighbors.NearestNeighbors`-like
+            `scipy.spatial.cKDTree` wrapped in the same query interface for
+            dense data with a Minkowski-family `distance`
         """
         try:
             return self._knn_tree
@@ -326,6 +596,12 @@ class kNNGraph(DataGraph):
                     **self.pynndescent_kwargs,
                 )
 
+            elif self.distance in _KDTREE_METRICS and not sparse.issparse(self.data_nu):
+                self._knn_tree = _KDTreeNeighbors(
+                    n_neighbors=self.knn + 1,
+                    p=_KDTREE_METRICS[self.distance],
+                    n_jobs=self.n_jobs,
+                ).fit(self.data_nu)
             else:
                 try:
                     self._knn_tree = NearestNeighbors(
@@ -452,6 +728,8 @@ class kNNGraph(DataGraph):
             knn_max = self.data_nu.shape[0]
 
         Y = self._check_extension_shape(Y)
+        if not sparse.issparse(Y):
+            Y = np.ascontiguousarray(Y, dtype=_affinity_dtype(self.data_nu))
         if self.decay is None or self.thresh == 1:
             with _logger.task("KNN search"):
                 # binary connectivity matrix
@@ -482,92 +760,99 @@ class kNNGraph(DataGraph):
                 if len(update_idx) > 0:
                     distances = [d for d in distances]
                     indices = [i for i in indices]
-                # increase the knn search
-                search_knn = min(search_knn * self.search_multiplier, knn_max)
-                while (
-                    (
-                        len(update_idx) > Y.shape[0] // 10
-                        and search_knn < self.data_nu.shape[0] / 2
-                    )
-                    # radius_neighbors not possible with pynndescent and large searches should be feasible
-                    or (len(update_idx) > 0 & self.use_pynndescent)
-                ) and search_knn < knn_max:
-                    print(
-                        f"remaining queries to complete: {len(update_idx)}, with current query size of {search_knn}"
-                    )
-                    dist_new, ind_new = knn_tree.kneighbors(
-                        Y[update_idx], n_neighbors=search_knn
-                    )
-                    for i, idx in enumerate(update_idx):
-                        distances[idx] = dist_new[i]
-                        indices[idx] = ind_new[i]
-                    update_idx = [
-                        i
-                        for i, d in enumerate(distances)
-                        if np.max(d)
-                        < (
-                            radius
-                            if isinstance(bandwidth, numbers.Number)
-                            else radius[i]
+                if self.use_pynndescent:
+                    # radius_neighbors not possible with pynndescent:
+                    # increase the knn search until all rows are covered
+                    row_radius = np.broadcast_to(radius, (Y.shape[0],))
+                    while len(update_idx) > 0 and search_knn < knn_max:
+                        search_knn = min(search_knn * self.search_multiplier, knn_max)
+                        if search_knn > self.data_nu.shape[0] / 2:
+                            knn_tree = NearestNeighbors(
+                                n_neighbors=search_knn,
+                                algorithm="brute",
+                                n_jobs=self.n_jobs,
+                            ).fit(self.data_nu)
+                        dist_new, ind_new = knn_tree.kneighbors(
+                            Y[update_idx], n_neighbors=search_knn
                         )
-                    ]
-                    _logger.debug(
-                        "search_knn = {}; {} remaining".format(
-                            search_knn, len(update_idx)
+                        for i, idx in enumerate(update_idx):
+                            distances[idx] = dist_new[i]
+                            indices[idx] = ind_new[i]
+                        update_idx = update_idx[
+                            np.max(dist_new, axis=1) < row_radius[update_idx]
+                        ]
+                        _logger.debug(
+                            "search_knn = {}; {} remaining".format(
+                                search_knn, len(update_idx)
+                            )
                         )
-                    )
-                    # increase the knn search
-                    search_knn = min(search_knn * self.search_multiplier, knn_max)
-                if search_knn > self.data_nu.shape[0] / 2:
-                    knn_tree = NearestNeighbors(
-                        n_neighbors=search_knn, algorithm="brute", n_jobs=self.n_jobs
-                    ).fit(self.data_nu)
-                if len(update_idx) > 0:
-                    if search_knn == knn_max:
+                elif len(update_idx) > 0:
+                    if knn_max < self.data_nu.shape[0]:
                         _logger.debug(
                             "knn search to knn_max ({}) on {}".format(
                                 knn_max, len(update_idx)
                             )
                         )
-                        # give up - search out to knn_max
+                        # search out to knn_max
                         dist_new, ind_new = knn_tree.kneighbors(
-                            Y[update_idx], n_neighbors=search_knn
+                            Y[update_idx], n_neighbors=knn_max
                         )
-                        for i, idx in enumerate(update_idx):
-                            distances[idx] = dist_new[i]
-                            indices[idx] = ind_new[i]
                     else:
                         _logger.debug("radius search on {}".format(len(update_idx)))
-                        # give up - radius search
-                        dist_new, ind_new = knn_tree.radius_neighbors(
-                            Y[update_idx, :],
-                            radius=radius
-                            if isinstance(bandwidth, numbers.Number)
-                            else np.max(radius[update_idx]),
-                        )
-                        for i, idx in enumerate(update_idx):
-                            distances[idx] = dist_new[i]
-                            indices[idx] = ind_new[i]
-                if isinstance(bandwidth, numbers.Number):
-                    data = np.concatenate(distances) / bandwidth
+                        row_radius = np.broadcast_to(radius, (Y.shape[0],))
+                        if isinstance(knn_tree, _KDTreeNeighbors):
+                            # search each row with its own radius
+                            dist_new, ind_new = knn_tree.radius_neighbors(
+                                Y[update_idx, :], radius=row_radius[update_idx]
+                            )
+                        else:
+                            # sklearn needs a scalar radius:
+                            # search in batches of rows with similar radius
+                            update_idx = update_idx[
+                                np.argsort(row_radius[update_idx])
+                            ]
+                            dist_new, ind_new = [], []
+                            for start in range(0, len(update_idx), _BLOCK_SIZE):
+                                batch_idx = update_idx[start : start + _BLOCK_SIZE]
+                                batch_dist, batch_ind = knn_tree.radius_neighbors(
+                                    Y[batch_idx, :],
+                                    radius=np.max(row_radius[batch_idx]),
+                                )
+                                dist_new.extend(batch_dist)
+                                ind_new.extend(batch_ind)
+                    for i, idx in enumerate(update_idx):
+                        distances[idx] = dist_new[i]
+                        indices[idx] = ind_new[i]
+                if isinstance(distances, np.ndarray):
+                    # every row was covered by the first search
+                    row_lengths = np.full(
+                        distances.shape[0], distances.shape[1], dtype=np.intp
+                    )
+                    data = distances.reshape(-1)
+                    indices = indices.reshape(-1)
                 else:
-                    data = np.concatenate(
-                        [distances[i] / bandwidth[i] for i in range(len(distances))]
+                    row_lengths = np.fromiter(
+                        (len(d) for d in distances),
+                        dtype=np.intp,
+                        count=len(distances),
                     )
-
-                indices = np.concatenate(indices)
-                indptr = np.concatenate([[0], np.cumsum([len(d) for d in distances])])
+                    data = np.concatenate(distances)
+                    indices = np.concatenate(indices)
+                indptr = np.zeros(len(row_lengths) + 1, dtype=np.intp)
+                np.cumsum(row_lengths, out=indptr[1:])
+                data = data.astype(_affinity_dtype(self.data_nu), copy=False)
+                if isinstance(bandwidth, numbers.Number):
+                    data /= bandwidth
+                else:
+                    data /= np.repeat(bandwidth, row_lengths)
+                _alpha_decay(data, self.decay, self.thresh)
+                # drop affinities below thresh before building the matrix
+                keep = data >= self.thresh
+                indptr = np.concatenate([[0], np.cumsum(keep)])[indptr]
                 K = sparse.csr_matrix(
-                    (data, indices, indptr), shape=(Y.shape[0], self.data_nu.shape[0])
+                    (data[keep], indices[keep], indptr),
+                    shape=(Y.shape[0], self.data_nu.shape[0]),
                 )
-                K.data = np.exp(-1 * np.power(K.data, self.decay))
-                # handle nan
-                K.data = np.where(np.isnan(K.data), 1, K.data)
-                # TODO: should we zero values that are below thresh?
-                K.data[K.data < self.thresh] = 0
-                K = K.tocoo()
-                K.eliminate_zeros()
-                K = K.tocsr()
         return K
 
 
@@ -673,6 +958,11 @@ class LandmarkGraph(DataGraph):
             self._reset_landmarks()
         return self
 
+    def _reset_kernel(self):
+        """Reset the kernel and landmark data"""
+        super()._reset_kernel()
+        self._reset_landmarks()
+
     def _reset_landmarks(self):
         """Reset landmark data
 
@@ -739,23 +1029,25 @@ class LandmarkGraph(DataGraph):
             self.build_landmark_op()
             return self._transitions
 
+    def _cluster_assignments(self):
+        """Sparse cluster indicator matrix, shape=[n_landmark, n_samples]
+
+        Multiplying by this matrix sums the rows (or, transposed, the columns)
+        of a matrix within each cluster in a single pass.
+        """
+        _, cluster_idx = np.unique(self.clusters, return_inverse=True)
+        n_samples = len(cluster_idx)
+        return sparse.csr_matrix(
+            (np.ones(n_samples), (cluster_idx, np.arange(n_samples))),
+            shape=(cluster_idx.max() + 1, n_samples),
+        )
+
     def _landmarks_to_data(self):
-        landmarks = np.unique(self.clusters)
-        if sparse.issparse(self.kernel):
-            pmn = sparse.vstack(
-                [
-                    sparse.csr_matrix(self.kernel[self.clusters == i, :].sum(axis=0))
-                    for i in landmarks
-                ]
-            )
-        else:
-            pmn = np.array(
-                [np.sum(self.kernel[self.clusters == i, :], axis=0) for i in landmarks]
-            )
-        return pmn
+        # sparsity agnostic matrix multiplication
+        return self._cluster_assignments() @ self.kernel
 
     def _data_transitions(self):
-        return normalize(self._landmarks_to_data(), "l1", axis=1)
+        return matrix.row_normalize(self._landmarks_to_data())
 
     def build_landmark_op(self):
         """Build the landmark operator
@@ -787,8 +1079,8 @@ class LandmarkGraph(DataGraph):
 
             # row normalize
             pnm = pmn.transpose()
-            pmn = normalize(pmn, norm="l1", axis=1)
-            pnm = normalize(pnm, norm="l1", axis=1)
+            pmn = matrix.row_normalize(pmn)
+            pnm = matrix.row_normalize(pnm)
             landmark_op = pmn.dot(pnm)  # sparsity agnostic matrix multiplication
             if is_sparse:
                 # no need to have a sparse landmark operator
@@ -822,21 +1114,9 @@ class LandmarkGraph(DataGraph):
             Transition matrix from `Y` to `self.data`
         """
         kernel = self.build_kernel_to_data(data, **kwargs)
-        if sparse.issparse(kernel):
-            pnm = sparse.hstack(
-                [
-                    sparse.csr_matrix(kernel[:, self.clusters == i].sum(axis=1))
-                    for i in np.unique(self.clusters)
-                ]
-            )
-        else:
-            pnm = np.array(
-                [
-                    np.sum(kernel[:, self.clusters == i], axis=1).T
-                    for i in np.unique(self.clusters)
-                ]
-            ).transpose()
-        pnm = normalize(pnm, norm="l1", axis=1)
+        # sum affinities within each cluster
+        pnm = kernel @ self._cluster_assignments().T
+        pnm = matrix.row_normalize(pnm)
         return pnm
 
     def interpolate(self, transform, transitions=None, Y=None):
@@ -1101,65 +1381,93 @@ class TraditionalGraph(DataGraph):
                 if self.precomputed == "distance":
                     pdx = self.data_nu
                 elif self.precomputed is None:
-                    pdx = pdist(self.data_nu, metric=self.distance)
-                    if np.any(pdx == 0):
-                        pdx = squareform(pdx)
-                        duplicate_ids = np.array(
-                            [i for i in np.argwhere(pdx == 0) if i[1] > i[0]]
-                        )
-                        if len(duplicate_ids) < 20:
-                            duplicate_names = ", ".join(
-                                ["{} and {}".format(i[0], i[1]) for i in duplicate_ids]
-                            )
-                            warnings.warn(
-                                "Detected zero distance between samples {}. "
-                                "Consider removing duplicates to avoid errors in "
-                                "downstream processing.".format(duplicate_names),
-                                RuntimeWarning,
-                            )
-                        else:
-                            warnings.warn(
-                                "Detected zero distance between {} pairs of samples. "
-                                "Consider removing duplicates to avoid errors in "
-                                "downstream processing.".format(len(duplicate_ids)),
-                                RuntimeWarning,
-                            )
+                    if callable(self.bandwidth):
+                        # callable bandwidth requires the full distance matrix
+                        pdx = _square_cdist(self.data_nu, metric=self.distance)
                     else:
-                        pdx = squareform(pdx)
+                        # distances are computed block by block
+                        pdx = None
                 else:
                     raise ValueError(
                         "precomputed='{}' not recognized. "
                         "Choose from ['affinity', 'adjacency', 'distance', "
                         "None]".format(self.precomputed)
                     )
-                if self.bandwidth is None:
-                    knn_dist = np.partition(pdx, self.knn + 1, axis=1)[
-                        :, : self.knn + 1
-                    ]
-                    bandwidth = np.max(knn_dist, axis=1)
-                elif callable(self.bandwidth):
-                    bandwidth = self.bandwidth(pdx)
+                if callable(self.bandwidth):
+                    bandwidth = self.bandwidth(pdx) * self.bandwidth_scale
+                elif self.bandwidth is not None:
+                    bandwidth = self.bandwidth * self.bandwidth_scale
                 else:
-                    bandwidth = self.bandwidth
-                bandwidth = bandwidth * self.bandwidth_scale
-                pdx = (pdx.T / bandwidth).T
-                K = np.exp(-1 * np.power(pdx, self.decay))
-                # handle nan
-                K = np.where(np.isnan(K), 1, K)
-        # truncate
-        if sparse.issparse(K):
-            if not (
-                isinstance(K, sparse.csr_matrix)
-                or isinstance(K, sparse.csc_matrix)
-                or isinstance(K, sparse.bsr_matrix)
-            ):
+                    bandwidth = None
+                n_samples = self.data_nu.shape[0]
+                K = np.empty(
+                    (n_samples, n_samples), dtype=_affinity_dtype(self.data_nu)
+                )
+                duplicate_ids = []
+                for start in range(0, n_samples, _BLOCK_SIZE):
+                    stop = min(start + _BLOCK_SIZE, n_samples)
+                    # each block is computed in place in its rows of K
+                    block = K[start:stop]
+                    if pdx is None and K.dtype == np.float64:
+                        cdist(
+                            self.data_nu[start:stop],
+                            self.data_nu,
+                            metric=self.distance,
+                            out=block,
+                        )
+                    elif pdx is None:
+                        # cdist only writes double precision output
+                        block[:] = cdist(
+                            self.data_nu[start:stop], self.data_nu, metric=self.distance
+                        )
+                    else:
+                        block[:] = pdx[start:stop]
+                    if self.precomputed is None:
+                        zero_idx = np.argwhere(block == 0)
+                        zero_idx[:, 0] += start
+                        duplicate_ids.append(zero_idx[zero_idx[:, 1] > zero_idx[:, 0]])
+                    if bandwidth is None:
+                        block_bandwidth = (
+                            np.partition(block, self.knn, axis=1)[:, self.knn]
+                            * self.bandwidth_scale
+                        )
+                    elif np.ndim(bandwidth) == 0:
+                        block_bandwidth = bandwidth
+                    else:
+                        block_bandwidth = bandwidth[start:stop]
+                    block /= np.reshape(block_bandwidth, (-1, 1))
+                    _alpha_decay(block, self.decay, self.thresh)
+                if self.precomputed is None:
+                    duplicate_ids = np.concatenate(duplicate_ids)
+                    if 0 < len(duplicate_ids) < 20:
+                        duplicate_names = ", ".join(
+                            ["{} and {}".format(i[0], i[1]) for i in duplicate_ids]
+                        )
+                        warnings.warn(
+                            "Detected zero distance between samples {}. "
+                            "Consider removing duplicates to avoid errors in "
+                            "downstream processing.".format(duplicate_names),
+                            RuntimeWarning,
+                        )
+                    elif len(duplicate_ids) >= 20:
+                        warnings.warn(
+                            "Detected zero distance between {} pairs of samples. "
+                            "Consider removing duplicates to avoid errors in "
+                            "downstream processing.".format(len(duplicate_ids)),
+                            RuntimeWarning,
+                        )
+        if self.precomputed in ["affinity", "adjacency"]:
+            # truncate (computed affinities are truncated block by block)
+            if sparse.issparse(K):
                 K = K.tocsr()
-            K.data[K.data < self.thresh] = 0
-            K = K.tocoo()
-            K.eliminate_zeros()
-            K = K.tocsr()
-        else:
-            K[K < self.thresh] = 0
+                # drop stored zeros and affinities below thresh
+                keep = (K.data != 0) & ~(K.data < self.thresh)
+                indptr = np.concatenate([[0], np.cumsum(keep)])[K.indptr]
+                K = sparse.csr_matrix(
+                    (K.data[keep], K.indices[keep], indptr), shape=K.shape
+                )
+            else:
+                K[K < self.thresh] = 0
         return K
 
     def build_kernel_to_data(self, Y, knn=None, bandwidth=None, bandwidth_scale=None):
@@ -1203,20 +1511,27 @@ class TraditionalGraph(DataGraph):
         else:
             with _logger.task("affinities"):
                 Y = self._check_extension_shape(Y)
-                pdx = cdist(Y, self.data_nu, metric=self.distance)
+                Y = np.ascontiguousarray(Y, dtype=_affinity_dtype(self.data_nu))
+                pdx = cdist(Y, self.data_nu, metric=self.distance).astype(
+                    _affinity_dtype(self.data_nu), copy=False
+                )
                 if bandwidth is None:
-                    knn_dist = np.partition(pdx, knn, axis=1)[:, :knn]
-                    bandwidth = np.max(knn_dist, axis=1)
+                    bandwidth = np.partition(pdx, knn - 1, axis=1)[:, knn - 1]
                 elif callable(bandwidth):
                     bandwidth = bandwidth(pdx)
                 bandwidth = bandwidth_scale * bandwidth
-                pdx = (pdx.T / bandwidth).T
-                K = np.exp(-1 * pdx ** self.decay)
-                # handle nan
-                K = np.where(np.isnan(K), 1, K)
-                K[K < self.thresh] = 0
+                pdx /= np.reshape(bandwidth, (-1, 1))
+                K = _alpha_decay(pdx, self.decay, self.thresh)
         return K
 
+    def symmetrize_kernel(self, K):
+        if self.kernel_symm == "+" and self.precomputed in [None, "distance"]:
+            # the kernel was allocated by `build_kernel` and can be overwritten
+            _logger.debug("Using addition symmetrization.")
+            return _symmetrize_average(K)
+        else:
+            return super().symmetrize_kernel(K)
+
     @property
     def weighted(self):
         if self.precomputed is not None:
@@ -1292,7 +1607,9 @@ class MNNGraph(DataGraph):
     ):
         self.beta = beta
         self.sample_idx = sample_idx
-        self.samples, self.n_cells = np.unique(self.sample_idx, return_counts=True)
+        self.samples, sample_codes, self.n_cells = np.unique(
+            self.sample_idx, return_inverse=True, return_counts=True
+        )
         self.knn = knn
         self.decay = decay
         self.distance = distance
@@ -1312,12 +1629,16 @@ class MNNGraph(DataGraph):
             )
         elif len(self.samples) == 1:
             raise ValueError("sample_idx must contain more than one unique value")
+        # row indices of each sample, found in a single sort
+        self._sample_rows = np.split(
+            np.argsort(sample_codes, kind="stable"), np.cumsum(self.n_cells)[:-1]
+        )
         if adaptive_k is not None:
             warnings.warn(
                 "`adaptive_k` has been deprecated. Using fixed knn.", DeprecationWarning
             )
 
-        super().__init__(data, n_pca=n_pca, **kwargs)
+        super().__init__(data, n_pca=n_pca, n_jobs=n_jobs, **kwargs)
 
     def _check_symmetrization(self, kernel_symm, theta):
         if (
@@ -1394,6 +1715,39 @@ class MNNGraph(DataGraph):
         super().set_params(**params)
         return self
 
+    def _build_subgraph(self, i, n_jobs):
+        """Build a kNN graph for cells within sample `i`"""
+        from .api import Graph
+
+        rows = self._sample_rows[i]
+        _logger.debug(
+            "subgraph {}: sample {}, "
+            "n = {}, knn = {}".format(i, self.samples[i], len(rows), self.knn)
+        )
+        return Graph(
+            self.data_nu[rows],
+            n_pca=None,
+            knn=self.knn,
+            decay=self.decay,
+            bandwidth=self.bandwidth,
+            distance=self.distance,
+            thresh=self.thresh,
+            verbose=self.verbose,
+            random_state=self.random_state,
+            n_jobs=n_jobs,
+            kernel_symm="+",
+            initialize=True,
+        )
+
+    def _build_kernel_between(self, i, j):
+        """Build the kernel from sample `i` to sample `j`"""
+        with _logger.task(
+            "kernel from sample {} to {}".format(self.samples[i], self.samples[j])
+        ):
+            return self.subgraphs[j].build_kernel_to_data(
+                self.subgraphs[i].data_nu, knn=self.knn
+            )
+
     def build_kernel(self):
         """Build the MNN kernel.
 
@@ -1405,74 +1759,77 @@ class MNNGraph(DataGraph):
             symmetric matrix with ones down the diagonal
             with no non-negative entries.
         """
+        if self.verbose:
+            # tasks logged from concurrent threads would interleave, so build
+            # serially and let the subgraphs search in parallel instead
+            n_jobs, subgraph_n_jobs = 1, self.n_jobs
+        else:
+            # samples are independent, so they are built concurrently, each
+            # searching single-threaded so that the thread pools do not nest
+            n_jobs, subgraph_n_jobs = self.n_jobs, 1
         with _logger.task("subgraphs"):
-            self.subgraphs = []
-            from .api import Graph
-
-            # iterate through sample ids
-            for i, idx in enumerate(self.samples):
-                _logger.debug(
-                    "subgraph {}: sample {}, "
-                    "n = {}, knn = {}".format(
-                        i, idx, np.sum(self.sample_idx == idx), self.knn
-                    )
-                )
-                # select data for sample
-                data = self.data_nu[self.sample_idx == idx]
-                # build a kNN graph for cells within sample
-                graph = Graph(
-                    data,
-                    n_pca=None,
-                    knn=self.knn,
-                    decay=self.decay,
-                    bandwidth=self.bandwidth,
-                    distance=self.distance,
-                    thresh=self.thresh,
-                    verbose=self.verbose,
-                    random_state=self.random_state,
-                    n_jobs=self.n_jobs,
-                    kernel_symm="+",
-                    initialize=True,
-                )
-                self.subgraphs.append(graph)  # append to list of subgraphs
+            self.subgraphs = Parallel(n_jobs=n_jobs, backend="threading")(
+                delayed(self._build_subgraph)(i, n_jobs=subgraph_n_jobs)
+                for i in range(len(self.samples))
+            )
 
         with _logger.task("MNN kernel"):
+            n_samples = self.data_nu.shape[0]
+            pairs = [
+                (i, j)
+                for i in range(len(self.subgraphs))
+                for j in range(len(self.subgraphs))
+                if i != j
+            ]
+            # kernels from each sample to every other sample
+            between_batch_kernels = Parallel(n_jobs=n_jobs, backend="threading")(
+                delayed(self._build_kernel_between)(i, j) for i, j in pairs
+            )
+            # later queries on the subgraphs run outside the pool
+            for graph in self.subgraphs:
+                graph.set_params(n_jobs=self.n_jobs)
+            # blocks of the kernel, with row scaling for between-sample blocks
+            blocks = [(i, i, X.K, None) for i, X in enumerate(self.subgraphs)]
+            within_batch_norms = [
+                np.array(np.sum(X.K, 1)).flatten() for X in self.subgraphs
+            ]
+            for (i, j), Kij in zip(pairs, between_batch_kernels):
+                between_batch_norm = np.array(np.sum(Kij, 1)).flatten()
+                scale = (
+                    np.minimum(1, within_batch_norms[i] / between_batch_norm)
+                    * self.beta
+                )
+                blocks.append((i, j, Kij, scale))
             if self.thresh > 0 or self.decay is None:
-                K = sparse.lil_matrix((self.data_nu.shape[0], self.data_nu.shape[0]))
+                # assemble all blocks at once from COO triplets
+                rows, cols, data = [], [], []
+                for i, j, Kij, scale in blocks:
+                    Kij = sparse.coo_matrix(Kij)
+                    rows.append(self._sample_rows[i][Kij.row])
+                    cols.append(self._sample_rows[j][Kij.col])
+                    if scale is None:
+                        data.append(Kij.data)
+                    else:
+                        data.append(Kij.data * scale[Kij.row])
+                K = sparse.coo_matrix(
+                    (
+                        np.concatenate(data),
+                        (np.concatenate(rows), np.concatenate(cols)),
+                    ),
+                    shape=(n_samples, n_samples),
+                ).tocsr()
+                # converting from COO sums duplicates and sorts indices
+                K.eliminate_zeros()
             else:
-                K = np.zeros([self.data_nu.shape[0], self.data_nu.shape[0]])
-            for i, X in enumerate(self.subgraphs):
-                K = matrix.set_submatrix(
-                    K,
-                    self.sample_idx == self.samples[i],
-                    self.sample_idx == self.samples[i],
-                    X.K,
-                )
-                within_batch_norm = np.array(np.sum(X.K, 1)).flatten()
-                for j, Y in enumerate(self.subgraphs):
-                    if i == j:
-                        continue
-                    with _logger.task(
-                        "kernel from sample {} to {}".format(
-                            self.samples[i], self.samples[j]
-                        )
-                    ):
-                        Kij = Y.build_kernel_to_data(X.data_nu, knn=self.knn)
-                        between_batch_norm = np.array(np.sum(Kij, 1)).flatten()
-                        scale = (
-                            np.minimum(1, within_batch_norm / between_batch_norm)
-                            * self.beta
-                        )
-                        if sparse.issparse(Kij):
-                            Kij = Kij.multiply(scale[:, None])
-                        else:
-                            Kij = Kij * scale[:, None]
-                        K = matrix.set_submatrix(
-                            K,
-                            self.sample_idx == self.samples[i],
-                            self.sample_idx == self.samples[j],
-                            Kij,
-                        )
+                # with thresh=0 every affinity is kept, so the kernel is full;
+                # the blocks cover every entry, so it needs no zero fill
+                K = np.empty([n_samples, n_samples])
+                for i, j, Kij, scale in blocks:
+                    if scale is not None:
+                        Kij = matrix.to_array(Kij) * scale[:, None]
+                    K = matrix.set_submatrix(
+                        K, self._sample_rows[i], self._sample_rows[j], Kij
+                    )
         return K
 
     def build_kernel_to_data(self, Y, theta=None):
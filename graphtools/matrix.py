@@ -13,12 +13,25 @@ def if_sparse(sparse_func, dense_func, *args, **kwargs):
         return dense_func(*args, **kwargs)
 
 
+def _canonical_csr(X):
+    """CSR matrix with sorted indices and no duplicates
+
+    SciPy's elementwise operations take a faster merge on canonical CSR.
+    `X` is copied only if it has to be canonicalized.
+    """
+    X = X.tocsr()
+    if not X.has_canonical_format:
+        X = X.copy()
+        X.sum_duplicates()
+    return X
+
+
 def sparse_minimum(X, Y):
-    return X.minimum(Y)
+    return _canonical_csr(X).minimum(_canonical_csr(Y))
 
 
 def sparse_maximum(X, Y):
-    return X.maximum(Y)
+    return _canonical_csr(X).maximum(_canonical_csr(Y))
 
 
 def elementwise_minimum(X, Y):
@@ -29,6 +42,60 @@ def elementwise_maximum(X, Y):
     return if_sparse(sparse_maximum, np.maximum, X, Y)
 
 
+def sparse_symmetric_minmax(X, theta):
+    X = _canonical_csr(X)
+    # pair each entry with its transpose in a single sparse addition: the
+    # real part of entry (i, j) is X[i, j] and the imaginary part is X[j, i]
+    pairs = X + 1j * X.T
+    X_ij, X_ji = pairs.data.real, pairs.data.imag
+    data = theta * np.minimum(X_ij, X_ji) + (1 - theta) * np.maximum(X_ij, X_ji)
+    X = sparse.csr_matrix((data, pairs.indices, pairs.indptr), shape=X.shape)
+    X.eliminate_zeros()
+    return X
+
+
+def dense_symmetric_minmax(X, theta):
+    XT = X.T
+    return theta * np.minimum(X, XT) + (1 - theta) * np.maximum(X, XT)
+
+
+def symmetric_minmax(X, theta):
+    """Weighted elementwise minimum and maximum of a matrix and its transpose
+
+    Computes `theta * min(X, X.T) + (1 - theta) * max(X, X.T)`.
+    """
+    return if_sparse(sparse_symmetric_minmax, dense_symmetric_minmax, X, theta=theta)
+
+
+def sparse_row_normalize(X):
+    X = X.tocsr()
+    row_sums = np.asarray(X.sum(axis=1)).ravel()
+    row_sums[row_sums == 0] = 1
+    return sparse.csr_matrix(
+        (
+            X.data / np.repeat(row_sums, np.diff(X.indptr)),
+            X.indices.copy(),
+            X.indptr.copy(),
+        ),
+        shape=X.shape,
+    )
+
+
+def dense_row_normalize(X):
+    X = np.asarray(X)
+    row_sums = X.sum(axis=1, keepdims=True)
+    row_sums[row_sums == 0] = 1
+    return X / row_sums
+
+
+def row_normalize(X):
+    """L1-normalize the rows of a non-negative matrix
+
+    Rows summing to zero are left unchanged.
+    """
+    return if_sparse(sparse_row_normalize, dense_row_normalize, X)
+
+
 def dense_set_diagonal(X, diag):
     X[np.diag_indices(X.shape[0])] = diag
     return X
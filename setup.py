@@ -4,9 +4,10 @@ from setuptools import setup
 
 install_requires = [
     "numpy>=1.14.0",
-    "scipy>=1.1.0",
+    "scipy>=1.6.0",
     "pygsp>=0.5.1",
     "scikit-learn>=0.20.0",
+    "joblib>=0.12",
     "future",
     "tasklogger>=1.0",
     "Deprecated",
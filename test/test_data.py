@@ -197,6 +197,14 @@ def test_precomputed_with_pca():
 #####################################################
 
 
+def test_fortran_order_data():
+    G = build_graph(np.asfortranarray(data), n_pca=None)
+    assert G.data_nu.flags["C_CONTIGUOUS"]
+    np.testing.assert_array_equal(G.data_nu, data)
+    K = G.build_kernel_to_data(np.asfortranarray(data[:10]))
+    np.testing.assert_allclose(K, G.build_kernel_to_data(data[:10]))
+
+
 def test_pandas_dataframe():
     G = build_graph(pd.DataFrame(data))
     assert isinstance(G, graphtools.base.BaseGraph)
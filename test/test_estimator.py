@@ -34,9 +34,16 @@ def test_estimator():
     assert E.reset
     assert not isinstance(E.graph, graphtools.graphs.LandmarkGraph)
     del E.reset
-    # change parameters that force reset
+    # change parameters that rebuild the kernel
+    G = E.graph
     E.set_params(knn=E.knn * 2)
     assert E.reset
+    assert E.graph is G
+    assert E.graph.knn == E.knn
+    del E.reset
+    # change parameters that force reset
+    E.set_params(decay=E.decay * 2)
+    assert E.reset
     assert E.graph is None
 
 
@@ -93,9 +100,9 @@ def test_pca():
 
 
 def test_anndata_input():
-    X = np.random.normal(0, 1, (10, 2))
+    X = np.random.RandomState(42).normal(0, 1, (10, 2)).astype(np.float32)
     E = Estimator(verbose=0)
-    E.fit(X.astype(np.float32))
+    E.fit(X)
     E2 = Estimator(verbose=0)
     E2.fit(anndata.AnnData(X))
     np.testing.assert_allclose(
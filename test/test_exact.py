@@ -59,6 +59,14 @@ def test_precomputed_with_pca():
         build_graph(squareform(pdist(data)), precomputed="distance", n_pca=20, decay=10)
 
 
+def test_precomputed_non_interned_string():
+    pdx = squareform(pdist(data[:200]))
+    precomputed = "".join(["dist", "ance"])
+    G = build_graph(pdx, n_pca=None, precomputed=precomputed, decay=10)
+    G2 = build_graph(pdx, n_pca=None, precomputed="distance", decay=10)
+    np.testing.assert_equal(G.K, G2.K)
+
+
 def test_exact_no_decay():
     with assert_raises_message(
         ValueError,
@@ -98,6 +106,21 @@ def test_precomputed_nonzero_diagonal():
         build_graph(np.zeros((10, 10)), precomputed="affinity", n_pca=None)
 
 
+def test_precomputed_sparse_affinity_thresh():
+    K = np.random.uniform(0, 1, [200, 200])
+    K = (K + K.T) / 2
+    np.fill_diagonal(K, 1)
+    K_sparse = sp.csc_matrix(K)
+    G = build_graph(K_sparse, precomputed="affinity", n_pca=None, thresh=0.5)
+    K[K < 0.5] = 0
+    assert isinstance(G.K, sp.csr_matrix)
+    assert G.K.nnz == np.count_nonzero(K)
+    np.testing.assert_equal(G.K.toarray(), K)
+    # the input affinities are not modified
+    assert np.all(K_sparse.data > 0)
+    assert K_sparse.nnz == 200 * 200
+
+
 def test_duplicate_data():
     with assert_warns_regex(
         RuntimeWarning,
@@ -398,6 +421,77 @@ def test_truncated_exact_graph_no_pca():
     assert isinstance(G2, graphtools.graphs.TraditionalGraph)
 
 
+def test_exact_graph_blocks():
+    k = 3
+    a = 13
+    n_pca = 20
+    thresh = 1e-4
+    pca = PCA(n_pca, svd_solver="randomized", random_state=42).fit(data)
+    data_nu = pca.transform(data)
+    pdx = squareform(pdist(data_nu, metric="euclidean"))
+    knn_dist = np.partition(pdx, k, axis=1)[:, :k]
+    epsilon = np.max(knn_dist, axis=1)
+    weighted_pdx = (pdx.T / epsilon).T
+    K = np.exp(-1 * weighted_pdx ** a)
+    K[K < thresh] = 0
+    W = K + K.T
+    W = np.divide(W, 2)
+    np.fill_diagonal(W, 0)
+    G = pygsp.graphs.Graph(W)
+    block_size = graphtools.graphs._BLOCK_SIZE
+    try:
+        # force several uneven blocks
+        graphtools.graphs._BLOCK_SIZE = 97
+        G2 = build_graph(
+            data,
+            thresh=thresh,
+            graphtype="exact",
+            n_pca=n_pca,
+            decay=a,
+            knn=k - 1,
+            random_state=42,
+            use_pygsp=True,
+        )
+    finally:
+        graphtools.graphs._BLOCK_SIZE = block_size
+    assert G.N == G2.N
+    np.testing.assert_allclose(G.dw, G2.dw)
+    np.testing.assert_allclose(G2.W.toarray(), G.W.toarray(), atol=1e-14)
+    assert isinstance(G2, graphtools.graphs.TraditionalGraph)
+
+
+def test_square_cdist_blocks():
+    block_size = graphtools.graphs._BLOCK_SIZE
+    try:
+        graphtools.graphs._BLOCK_SIZE = 97
+        pdx = graphtools.graphs._square_cdist(data[:500], metric="cosine")
+    finally:
+        graphtools.graphs._BLOCK_SIZE = block_size
+    np.testing.assert_allclose(pdx, squareform(pdist(data[:500], metric="cosine")))
+
+
+def test_exact_graph_float32():
+    G = build_graph(data, n_pca=20, decay=10, thresh=1e-4, graphtype="exact")
+    G32 = build_graph(
+        data.astype(np.float32), n_pca=20, decay=10, thresh=1e-4, graphtype="exact"
+    )
+    assert G32.K.dtype == np.float32
+    assert G32.build_kernel_to_data(G32.data_nu[:10]).dtype == np.float32
+    np.testing.assert_allclose(G32.K, G.K, atol=1e-4)
+
+
+def test_symmetrize_average_blocks():
+    K = np.random.uniform(size=(500, 500))
+    expected = (K + K.T) / 2
+    block_size = graphtools.graphs._BLOCK_SIZE
+    try:
+        graphtools.graphs._BLOCK_SIZE = 97
+        graphtools.graphs._symmetrize_average(K)
+    finally:
+        graphtools.graphs._BLOCK_SIZE = block_size
+    np.testing.assert_equal(K, expected)
+
+
 def test_exact_graph_fixed_bandwidth():
     decay = 2
     knn = None
@@ -70,6 +70,91 @@ def test_balltree_cosine():
         build_graph(data, n_pca=20, decay=10, distance="cosine", thresh=1e-4)
 
 
+def test_kdtree_matches_balltree():
+    from sklearn.neighbors import NearestNeighbors
+
+    G = build_graph(data, n_pca=20, decay=10, thresh=1e-4)
+    assert isinstance(G.knn_tree, graphtools.graphs._KDTreeNeighbors)
+    nn = NearestNeighbors(algorithm="ball_tree").fit(G.data_nu)
+    Y = G.data_nu[:50]
+    dist_kd, ind_kd = G.knn_tree.kneighbors(Y, n_neighbors=10)
+    dist_bt, ind_bt = nn.kneighbors(Y, n_neighbors=10)
+    np.testing.assert_allclose(dist_kd, dist_bt)
+    np.testing.assert_array_equal(ind_kd, ind_bt)
+    radius = np.median(dist_bt[:, -1])
+    dist_kd, ind_kd = G.knn_tree.radius_neighbors(Y, radius=radius)
+    dist_bt, ind_bt = nn.radius_neighbors(Y, radius=radius, sort_results=True)
+    for i in range(len(Y)):
+        np.testing.assert_allclose(dist_kd[i], dist_bt[i])
+        np.testing.assert_array_equal(ind_kd[i], ind_bt[i])
+    np.testing.assert_array_equal(
+        G.knn_tree.kneighbors_graph(Y, n_neighbors=10).toarray(),
+        nn.kneighbors_graph(Y, n_neighbors=10).toarray(),
+    )
+    # per-row radius
+    row_radius = nn.kneighbors(Y, n_neighbors=10)[0][:, -1] / 2
+    _, ind_kd = G.knn_tree.radius_neighbors(Y, radius=row_radius)
+    for i in range(len(Y)):
+        _, ind_bt = nn.radius_neighbors(
+            Y[i : i + 1], radius=row_radius[i], sort_results=True
+        )
+        np.testing.assert_array_equal(ind_kd[i], ind_bt[0])
+    np.testing.assert_array_equal(
+        G.knn_tree.radius_neighbors_graph(Y, radius=radius).toarray(),
+        nn.radius_neighbors_graph(Y, radius=radius).toarray(),
+    )
+    # sklearn defaults
+    np.testing.assert_array_equal(
+        G.knn_tree.kneighbors(Y, return_distance=False),
+        nn.kneighbors(Y, n_neighbors=G.knn + 1, return_distance=False),
+    )
+    np.testing.assert_array_equal(
+        G.knn_tree.kneighbors(Y, 4, return_distance=False),
+        nn.kneighbors(Y, 4, return_distance=False),
+    )
+    # queries on the fitted data exclude each point itself
+    dist_kd, ind_kd = G.knn_tree.kneighbors(n_neighbors=4)
+    dist_bt, ind_bt = nn.kneighbors(n_neighbors=4)
+    np.testing.assert_allclose(dist_kd, dist_bt)
+    np.testing.assert_array_equal(ind_kd, ind_bt)
+    np.testing.assert_array_equal(
+        G.knn_tree.kneighbors_graph(n_neighbors=4).toarray(),
+        nn.kneighbors_graph(n_neighbors=4).toarray(),
+    )
+    np.testing.assert_array_equal(
+        G.knn_tree.radius_neighbors_graph(radius=radius).toarray(),
+        nn.radius_neighbors_graph(radius=radius).toarray(),
+    )
+
+
+def test_knn_graph_float32():
+    G = build_graph(data, n_pca=20, decay=10, thresh=1e-4)
+    G32 = build_graph(data.astype(np.float32), n_pca=20, decay=10, thresh=1e-4)
+    assert G32.data_nu.dtype == np.float32
+    K = G32.build_kernel_to_data(G32.data_nu)
+    assert K.dtype == np.float32
+    assert G32.K.dtype == np.float32
+    np.testing.assert_allclose(G32.K.toarray(), G.K.toarray(), atol=1e-4)
+    # only single precision data gives a single precision kernel
+    G8 = build_graph(
+        (data - data.min()).astype(np.uint8), n_pca=None, decay=10, thresh=1e-4
+    )
+    assert G8.data_nu.dtype == np.uint8
+    assert G8.K.dtype == np.float64
+
+
+def test_knn_graph_mnn_symmetrization():
+    for theta in [0, 0.5, 1]:
+        G = build_graph(
+            data, n_pca=20, decay=10, thresh=1e-4, kernel_symm="mnn", theta=theta
+        )
+        K = G.build_kernel().toarray()
+        np.testing.assert_allclose(
+            G.K.toarray(),
+            theta * np.minimum(K, K.T) + (1 - theta) * np.maximum(K, K.T),
+        )
+
+
 def test_k_too_large():
     with assert_warns_message(
         UserWarning,
@@ -299,6 +384,71 @@ def test_knnmax():
     assert (G.W - G2.W).nnz == 0
 
 
+def test_knn_radius_search():
+    data = datasets.make_swiss_roll()[0]
+    k = 5
+    a = 2
+    thresh = 1e-4
+    pdx = squareform(pdist(data, metric="euclidean"))
+    knn_dist = np.partition(pdx, k, axis=1)[:, :k]
+    epsilon = np.max(knn_dist, axis=1)
+    pdx = (pdx.T / epsilon).T
+    K = np.exp(-1 * pdx ** a)
+    K[K < thresh] = 0
+    K = K + K.T
+    W = np.divide(K, 2)
+    np.fill_diagonal(W, 0)
+    G = pygsp.graphs.Graph(W)
+    G2 = build_graph(
+        data,
+        n_pca=None,
+        decay=a,
+        knn=k - 1,
+        thresh=thresh,
+        search_multiplier=1,
+        random_state=42,
+        use_pygsp=True,
+    )
+    assert isinstance(G2, graphtools.graphs.kNNGraph)
+    assert G.N == G2.N
+    np.testing.assert_allclose(G.dw, G2.dw)
+    np.testing.assert_allclose((G.W - G2.W).data, 0, atol=1e-14)
+    block_size = graphtools.graphs._BLOCK_SIZE
+    try:
+        # force several radius search batches
+        graphtools.graphs._BLOCK_SIZE = 7
+        G3 = build_graph(
+            data,
+            n_pca=None,
+            decay=a,
+            knn=k - 1,
+            thresh=thresh,
+            search_multiplier=1,
+            random_state=42,
+            use_pygsp=True,
+        )
+        # sparse data is searched with sklearn, which needs a scalar radius
+        with assert_warns_message(
+            UserWarning, "cannot use tree with sparse input: using brute force"
+        ):
+            G4 = build_graph(
+                sp.csr_matrix(data),
+                n_pca=None,
+                decay=a,
+                knn=k - 1,
+                thresh=thresh,
+                search_multiplier=1,
+                random_state=42,
+                use_pygsp=True,
+            )
+    finally:
+        graphtools.graphs._BLOCK_SIZE = block_size
+    assert not isinstance(G4.knn_tree, graphtools.graphs._KDTreeNeighbors)
+    np.testing.assert_allclose((G2.W - G3.W).data, 0, atol=1e-14)
+    # brute force distances differ in the last few bits
+    np.testing.assert_allclose((G2.W - G4.W).data, 0, atol=1e-12)
+
+
 def test_thresh_small():
     data = datasets.make_swiss_roll()[0]
     G = graphtools.Graph(data, thresh=1e-30)
@@ -612,6 +762,43 @@ def test_verbose():
     build_graph(data, decay=None, verbose=True)
 
 
+def test_set_params_kernel():
+    G = build_graph(data, decay=10, thresh=1e-4)
+    G.K
+    knn_tree = G.knn_tree
+    G.set_params(knn=5, thresh=1e-3)
+    assert not hasattr(G, "_kernel")
+    assert G.knn_tree is knn_tree
+    G2 = build_graph(data, decay=10, knn=5, thresh=1e-3)
+    np.testing.assert_allclose(G.K.toarray(), G2.K.toarray())
+    with assert_raises_message(
+        ValueError, "Cannot update knn. Please create a new graph"
+    ):
+        G.set_params(knn=data.shape[0])
+    # a rejected update leaves knn, thresh and the kernel unchanged
+    K = G.K
+    with assert_raises_message(
+        ValueError, "Cannot update decay. Please create a new graph"
+    ):
+        G.set_params(knn=10, thresh=1e-2, decay=20)
+    with assert_raises_message(
+        ValueError, "Cannot update theta. Please create a new graph"
+    ):
+        G.set_params(knn=10, theta=0.5)
+    assert G.knn == 5
+    assert G.thresh == 1e-3
+    assert G.K is K
+    G = build_graph(data, decay=10, thresh=1e-4, use_pygsp=True)
+    with assert_raises_message(
+        ValueError, "Cannot update knn. Please create a new graph"
+    ):
+        G.set_params(knn=15)
+    with assert_raises_message(
+        ValueError, "Cannot update thresh. Please create a new graph"
+    ):
+        G.set_params(thresh=1e-3)
+
+
 def test_set_params():
     G = build_graph(data, decay=None)
     assert G.get_params() == {
@@ -638,10 +825,6 @@ def test_set_params():
     G.set_params(verbose=2)
     assert G.verbose == 2
     G.set_params(verbose=0)
-    with assert_raises_message(
-        ValueError, "Cannot update knn. Please create a new graph"
-    ):
-        G.set_params(knn=15)
     with assert_raises_message(
         ValueError, "Cannot update knn_max. Please create a new graph"
     ):
@@ -654,10 +837,6 @@ def test_set_params():
         ValueError, "Cannot update distance. Please create a new graph"
     ):
         G.set_params(distance="manhattan")
-    with assert_raises_message(
-        ValueError, "Cannot update thresh. Please create a new graph"
-    ):
-        G.set_params(thresh=1e-3)
     with assert_raises_message(
         ValueError, "Cannot update theta. Please create a new graph"
     ):
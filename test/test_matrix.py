@@ -2,6 +2,7 @@ import graphtools.matrix
 import graphtools.utils
 from parameterized import parameterized
 from scipy import sparse
+from sklearn.preprocessing import normalize
 import numpy as np
 import graphtools
 from load_tests import data
@@ -25,6 +26,67 @@ def test_nonzero_discrete(matrix_class):
     assert not graphtools.matrix.nonzero_discrete(X, [1, 3])
 
 
+@parameterized(
+    [
+        (np.array,),
+        (np.matrix,),
+        (sparse.csr_matrix,),
+        (sparse.csc_matrix,),
+        (sparse.coo_matrix,),
+    ]
+)
+def test_row_normalize(matrix_class):
+    X = np.random.choice([0, 1, 2], p=[0.9, 0.05, 0.05], size=(100, 50))
+    X[0] = 0
+    Y = graphtools.matrix.row_normalize(matrix_class(X))
+    np.testing.assert_allclose(
+        graphtools.matrix.to_array(Y), normalize(X, norm="l1", axis=1)
+    )
+
+
+@parameterized(
+    [
+        (np.array,),
+        (np.matrix,),
+        (sparse.csr_matrix,),
+        (sparse.csc_matrix,),
+        (sparse.coo_matrix,),
+    ]
+)
+def test_symmetric_minmax(matrix_class):
+    X = np.random.choice([0, 1, 2], p=[0.9, 0.05, 0.05], size=(100, 100))
+    X = X * np.random.uniform(size=X.shape)
+    for theta in [0, 0.3, 1]:
+        Y = graphtools.matrix.symmetric_minmax(matrix_class(X), theta)
+        np.testing.assert_array_equal(
+            graphtools.matrix.to_array(Y),
+            theta * np.minimum(X, X.T) + (1 - theta) * np.maximum(X, X.T),
+        )
+
+
+def test_elementwise_minmax_non_canonical():
+    X = np.random.choice([0, 1, 2], p=[0.9, 0.05, 0.05], size=(50, 50))
+    X = X * np.random.uniform(size=X.shape)
+    # split every entry into two duplicates, in reverse column order
+    indices = [np.tile(np.flatnonzero(x)[::-1], 2) for x in X]
+    data = [x[i] / 2 for x, i in zip(X, indices)]
+    indptr = np.concatenate([[0], np.cumsum([len(i) for i in indices])])
+    X_sparse = sparse.csr_matrix(
+        (np.concatenate(data), np.concatenate(indices), indptr), shape=X.shape
+    )
+    assert not X_sparse.has_canonical_format
+    Y = sparse.csr_matrix(X.T)
+    np.testing.assert_allclose(
+        graphtools.matrix.elementwise_minimum(X_sparse, Y).toarray(),
+        np.minimum(X, X.T),
+    )
+    np.testing.assert_allclose(
+        graphtools.matrix.elementwise_maximum(X_sparse, Y).toarray(),
+        np.maximum(X, X.T),
+    )
+    assert not X_sparse.has_canonical_format
+
+
 @parameterized([(0,), (1e-4,)])
 def test_nonzero_discrete_knngraph(thresh):
     G = graphtools.Graph(data, n_pca=10, knn=5, decay=None, thresh=thresh)
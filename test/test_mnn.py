@@ -4,6 +4,7 @@ from load_tests import (
     graphtools,
     np,
     pd,
+    sp,
     pygsp,
     nose2,
     data,
@@ -472,6 +473,15 @@ def test_mnn_graph_decay():
 # TODO: add interpolation tests
 
 
+def test_mnn_kernel_canonical_csr():
+    X, sample_idx = generate_swiss_roll()
+    G = build_graph(X, sample_idx=sample_idx, n_pca=None, decay=10, thresh=1e-4, beta=0)
+    K = G.build_kernel()
+    assert isinstance(K, sp.csr_matrix)
+    assert K.has_canonical_format
+    assert np.all(K.data != 0)
+
+
 def test_verbose():
     X, sample_idx = generate_swiss_roll()
     print()
@@ -481,6 +491,32 @@ def test_verbose():
     )
 
 
+def test_mnn_n_jobs():
+    X, sample_idx = generate_swiss_roll()
+    G = build_graph(
+        X,
+        sample_idx=sample_idx,
+        kernel_symm="mnn",
+        theta=0.5,
+        n_pca=None,
+        thresh=1e-4,
+        n_jobs=1,
+    )
+    G2 = build_graph(
+        X,
+        sample_idx=sample_idx,
+        kernel_symm="mnn",
+        theta=0.5,
+        n_pca=None,
+        thresh=1e-4,
+        n_jobs=2,
+    )
+    np.testing.assert_allclose(G.K.toarray(), G2.K.toarray())
+    for graph in G2.subgraphs:
+        assert graph.n_jobs == 2
+        assert graph.knn_tree.n_jobs == 2
+
+
 def test_set_params():
     X, sample_idx = generate_swiss_roll()
     G = build_graph(
@@ -498,7 +534,7 @@ def test_set_params():
         "bandwidth": None,
         "distance": "euclidean",
         "thresh": 1e-4,
-        "n_jobs": 1,
+        "n_jobs": -1,
     }
     G.set_params(n_jobs=4)
     assert G.n_jobs == 4